@@ -17,6 +17,10 @@ class _Preprocess(object):
     functions in the module, if the key is not present then that function will 
     be skipped when the preprocessing pipeline is run.
 
+    Subclasses are registered with the PIPELINE when they are defined, by
+    passing the name as a class keyword, e.g.
+    ``class Detrend(_Preprocess, name="detrend"):``.
+
     There are two special AxisManagers expected to be part of the preprocessing
     pipeline. ``aman`` is the "standard" time ordered data AxisManager that is
     loaded via our default styles. ``proc_aman`` is the preprocess AxisManager,
@@ -24,12 +28,27 @@ class _Preprocess(object):
     Archive is connected to the preprocessing pipeline. 
     """    
 
+    def __init_subclass__(cls, name=None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if name is None:
+            return
+        other = PIPELINE.get(name)
+        if other is not None and (
+                (other.__module__, other.__qualname__)
+                != (cls.__module__, cls.__qualname__)):
+            # Same class re-defined (e.g. on module reload) is fine,
+            # a different one claiming the name is not.
+            raise ValueError(f"Preprocess name '{name}' is already "
+                             f"registered to {other.__qualname__}")
+        cls.name = name
+        PIPELINE[name] = cls
+
     def __init__(self, step_cfgs):
         self.process_cfgs = step_cfgs.get("process")
         self.calc_cfgs = step_cfgs.get("calc")
         self.save_cfgs = step_cfgs.get("save")
         self.select_cfgs = step_cfgs.get("select")
-    
+
     def process(self, aman, proc_aman):
         """ This function makes changes to the time ordered data AxisManager.
         Ex: calibrating or detrending the timestreams. This function will use
@@ -12,26 +12,24 @@ from sotodlib.core.flagman import (has_any_cuts, has_all_cut,
 from .core import _Preprocess
 
 
-class FFTTrim(_Preprocess):
+class FFTTrim(_Preprocess, name="fft_trim"):
     """Trim the AxisManager to optimize for faster FFTs later in the pipeline.
     All processing configs go to `fft_trim`
 
     .. autofunction:: sotodlib.tod_ops.fft_trim
     """
-    name = "fft_trim"    
     def process(self, aman, proc_aman):
         tod_ops.fft_trim(aman, **self.process_cfgs)
 
-class Detrend(_Preprocess):
+class Detrend(_Preprocess, name="detrend"):
     """Detrend the signal. All processing configs go to `detrend_tod`
 
     .. autofunction:: sotodlib.tod_ops.detrend_tod
     """
-    name = "detrend"
     def process(self, aman, proc_aman):
         tod_ops.detrend_tod(aman, **self.process_cfgs)
         
-class Trends(_Preprocess):
+class Trends(_Preprocess, name="trends"):
     """Calculate the trends in the data to look for unlocked detectors. All
     calculation configs go to `get_trending_flags`.
 
@@ -41,7 +39,6 @@ class Trends(_Preprocess):
     
     .. autofunction:: sotodlib.flags.get_trending_flags
     """
-    name = "trends"
     
     def calc_and_save(self, aman, proc_aman):
         trend_cut, trend_aman = flags.get_trending_flags(
@@ -70,7 +67,7 @@ class Trends(_Preprocess):
         meta.restrict("dets", meta.dets.vals[keep])
         return meta
 
-class GlitchDetection(_Preprocess):
+class GlitchDetection(_Preprocess, name="glitches"):
     """Run glitch detection algorithm to find glitches. All calculation configs
     go to `get_glitch_flags` 
 
@@ -81,7 +78,6 @@ class GlitchDetection(_Preprocess):
 
     .. autofunction:: sotodlib.flags.get_glitch_flags
     """
-    name = "glitches"
     
     def calc_and_save(self, aman, proc_aman):
         glitch_cut, glitch_aman = flags.get_glitch_flags(
@@ -109,13 +105,12 @@ class GlitchDetection(_Preprocess):
         meta.restrict("dets", meta.dets.vals[keep])
         return meta
     
-class PSDCalc(_Preprocess):
+class PSDCalc(_Preprocess, name="psd"):
     """ Calculate the PSD of the data and add it to the AxisManager under the
     "psd" field. All process configs goes to `calc_psd`
 
     .. autofunction:: sotodlib.tod_ops.fft_ops.calc_psd
     """
-    name = "psd"
     
     def process(self, aman, proc_aman):
         freqs, Pxx = tod_ops.fft_ops.calc_psd(aman, **self.process_cfgs)
@@ -134,7 +129,7 @@ class PSDCalc(_Preprocess):
         if self.save_cfgs:
             proc_aman.wrap("psd", fft_aman)
 
-class Noise(_Preprocess):
+class Noise(_Preprocess, name="noise"):
     """Estimate the white noise levels in the data. Assumes the PSD has been
     wrapped into the AxisManager. All calculation configs goes to `calc_wn`. 
 
@@ -144,7 +139,6 @@ class Noise(_Preprocess):
     
     .. autofunction:: sotodlib.tod_ops.fft_ops.calc_wn
     """
-    name = "noise"
     
     def calc_and_save(self, aman, proc_aman):
         if "psd" not in aman:
@@ -172,7 +166,7 @@ class Noise(_Preprocess):
         meta.restrict("dets", meta.dets.vals[keep])
         return meta
     
-class Calibrate(_Preprocess):
+class Calibrate(_Preprocess, name="calibrate"):
     """Calibrate the timestreams based on some provided information.
 
     Type of calibration is decided by process["kind"]
@@ -182,7 +176,6 @@ class Calibrate(_Preprocess):
 
     2. to be expanded
     """
-    name = "calibrate"
     
     def process(self, aman, proc_aman):
         if self.process_cfgs["kind"] == "single_value":
@@ -191,14 +184,13 @@ class Calibrate(_Preprocess):
             raise ValueError(f"Entry '{self.process_cfgs['kind']}'"
                               " not understood")
 
-class EstimateHWPSS(_Preprocess):
+class EstimateHWPSS(_Preprocess, name="estimate_hwpss"):
     """
     Builds a HWPSS Template. Calc configs go to ``hwpss_model``.
     Results of fitting saved if field specified by calc["name"]
 
     .. autofunction:: sotodlib.hwp.hwp.get_hwpss
     """
-    name = "estimate_hwpss"
 
     def calc_and_save(self, aman, proc_aman):
         hwpss_stats = hwp.get_hwpss(aman, **self.calc_cfgs)
@@ -210,12 +202,11 @@ class EstimateHWPSS(_Preprocess):
         if self.save_cfgs:
             proc_aman.wrap(self.calc_cfgs["hwpss_stats_name"], hwpss_stats)
 
-class SubtractHWPSS(_Preprocess):
+class SubtractHWPSS(_Preprocess, name="subtract_hwpss"):
     """Subtracts a HWPSS template from signal. 
 
     .. autofunction:: sotodlib.hwp.hwp.subtract_hwpss
     """
-    name = "subtract_hwpss"
 
     def process(self, aman, proc_aman):
         hwp.subtract_hwpss(
@@ -224,33 +215,30 @@ class SubtractHWPSS(_Preprocess):
             subtract_name = self.process_cfgs["subtract_name"]
         )
 
-class Apodize(_Preprocess):
+class Apodize(_Preprocess, name="apodize"):
     """Apodize the edges of a signal. All process configs go to `apodize_cosine`
 
     .. autofunction:: sotodlib.tod_ops.apodize.apodize_cosine
     """
-    name = "apodize"
 
     def process(self, aman, proc_aman):
         tod_ops.apodize.apodize_cosine(aman, **self.process_cfgs)
 
-class Demodulate(_Preprocess):
+class Demodulate(_Preprocess, name="demodulate"):
     """Demodulate the tod. All process confgis go to `demod_tod`.
 
     .. autofunction:: sotodlib.hwp.hwp.demod_tod
     """
-    name = "demodulate"
 
     def process(self, aman, proc_aman):
         hwp.demod_tod(aman, **self.process_cfgs)
 
 
-class GlitchFill(_Preprocess):
+class GlitchFill(_Preprocess, name="glitchfill"):
     """Fill glitches. All process configs go to `fill_glitches`.
 
     .. autofunction:: sotodlib.tod_ops.gapfill.fill_glitches
     """
-    name = "glitchfill"
 
     def process(self, aman):
         pcfgs = np.fromiter(self.process_cfgs.keys(), dtype='U16')
@@ -272,16 +260,3 @@ class GlitchFill(_Preprocess):
 
         tod_ops.gapfill.fill_glitches(aman, signal=signal, glitch_flags=flags, **args)
 
-
-_Preprocess.register(Trends.name, Trends)
-_Preprocess.register(FFTTrim.name, FFTTrim)
-_Preprocess.register(Detrend.name, Detrend)
-_Preprocess.register(GlitchDetection.name, GlitchDetection)
-_Preprocess.register(PSDCalc.name, PSDCalc)
-_Preprocess.register(Noise.name, Noise)
-_Preprocess.register(Calibrate.name, Calibrate)
-_Preprocess.register(EstimateHWPSS.name, EstimateHWPSS)
-_Preprocess.register(SubtractHWPSS.name, SubtractHWPSS)
-_Preprocess.register(Apodize.name, Apodize)
-_Preprocess.register(Demodulate.name, Demodulate)
-_Preprocess.register(GlitchFill.name, GlitchFill)
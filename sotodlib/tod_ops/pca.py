@@ -1,16 +1,23 @@
 from sotodlib import core
+import functools
 import numpy as np
+import scipy.linalg
+import scipy.linalg.blas
+import scipy.sparse.linalg
+import logging
 
-# Note to future developers with a need for speed: there are two
-# obvious places where OpenMP acceleration in a C++ routine would be
-# helpful.  np.cov is not threaded, for some reason.  And in our mode
-# removal we loop over detectors in python.  In both cases the
-# algorithms are simple and parallelize trivially.  Thankfully
-# np.linalg.eig is already threaded.
+logger = logging.getLogger(__name__)
+
+# Note to future developers with a need for speed: the covariance
+# computation (rather than np.cov, which is not threaded) and the mode
+# removal are both written as matrix products, so that threaded BLAS
+# does the heavy lifting.  The eigendecomposition is already threaded.
+# Mode removal for a subset of detectors works block-wise, in place,
+# which keeps memory use down without needing a compiled kernel.
 
 
 def get_pca_model(tod=None, pca=None, n_modes=None, signal=None,
-                  wrap=None, wrap_pca=None):
+                  wrap=None, wrap_pca=None, dtype=None):
     """Convert a PCA decomposition into the signal basis, i.e. into
     time-dependent modes that one might use for cleaning or
     calibrating.
@@ -47,6 +54,13 @@ def get_pca_model(tod=None, pca=None, n_modes=None, signal=None,
             signal is also used to compute the covariance for PCA.
         wrap: string; if specified then the returned result is also
             stored in tod under that name.
+        dtype: dtype in which to project signal onto the eigenmodes,
+            and hence the dtype of the output 'modes'.  Defaults to
+            the dtype of signal.  Note that if this differs from the
+            signal dtype, a converted copy of signal is made; passing
+            float32 for float64 signal saves memory in 'modes' but
+            not time, and reduces the precision of any later mode
+            removal.
 
     Returns:
         An AxisManager with (dets, eigen, samps) axes.  The field
@@ -55,7 +69,7 @@ def get_pca_model(tod=None, pca=None, n_modes=None, signal=None,
 
     """
     if pca is None:
-        pca = get_pca(tod=tod, signal=signal)
+        pca = get_pca(tod=tod, signal=signal, n_modes=n_modes)
     if n_modes is None:
         n_modes = pca.eigen.count
 
@@ -64,14 +78,20 @@ def get_pca_model(tod=None, pca=None, n_modes=None, signal=None,
     if signal is None:
         signal = tod.signal
 
+    if dtype is None:
+        dtype = signal.dtype
+
     R = pca.R[:, :n_modes]
     output.wrap('weights', R, [(0, 'dets'), (1, 'eigen')])
-    output.wrap('modes', np.dot(R.transpose(), signal),
-                [(0, 'eigen'), (1, 'samps')])
+    # Give BLAS a row-major (eigen, dets) operand, cast in the same pass.
+    Rt = np.ascontiguousarray(R.T, dtype=dtype)
+    modes = Rt @ signal.astype(dtype, copy=False)
+    output.wrap('modes', modes, [(0, 'eigen'), (1, 'samps')])
     return output
 
 
-def get_pca(tod=None, cov=None, signal=None, wrap=None):
+def get_pca(tod=None, cov=None, signal=None, wrap=None, use_gpu=None,
+            n_modes=None, keep_cov=False):
     """Compute a PCA decomposition of the kind useful for signal analysis.
     A symmetric non-negative matrix cov of shape(n_dets, n_dets) can
     be decomposed into matrix R (same shape) and vector E (length
@@ -91,35 +111,201 @@ def get_pca(tod=None, cov=None, signal=None, wrap=None):
             tod.signal.
         wrap: string; if set then the returned result is also stored
             in tod under this name.
+        use_gpu: boolean; if True then the covariance and
+            eigendecomposition are computed on a GPU using CuPy.  If
+            CuPy or a CUDA device is not available, a warning is
+            logged and the CPU is used instead.  Defaults to True if
+            signal (or cov) is a CuPy array, and False otherwise.
+        n_modes: integer; if set then only the strongest n_modes
+            eigenmodes are kept in the output.  Defaults to len(dets).
+            When n_modes is much smaller than len(dets), the modes
+            are found with a partial (Lanczos) eigensolver.
+        keep_cov: boolean; if True then the covariance matrix is also
+            stored in the output, as 'cov'.  Otherwise, if cov was
+            computed here, the eigensolver is allowed to overwrite it,
+            which saves a (dets, dets) copy.
 
     Returns:
-        AxisManager with axes 'dets' and 'eigen' (of the same length),
+        AxisManager with axes 'dets' and 'eigen' (of length n_modes),
         containing fields 'R' of shape (dets, eigen) and 'E' of shape
-        (eigen).  The eigenmodes are sorted from strongest to weakest.
+        (eigen).  The eigenmodes are sorted from strongest to weakest,
+        and each column of R has its largest component positive.
+        If keep_cov, the field 'cov' of shape (dets, dets) is also
+        present.
 
     """
-    if cov is None:
-        # Compute it from signal
-        if signal is None:
-            signal = tod.signal
-        cov = np.cov(signal)
-    dets = tod.dets
+    if cov is None and signal is None:
+        signal = tod.signal
+    if use_gpu is None:
+        use_gpu = _is_cupy(signal) or _is_cupy(cov)
+    if use_gpu and _get_cupy() is None:
+        logger.warning('CuPy or CUDA device not available; computing '
+                       'PCA on the CPU.')
+        use_gpu = False
+
+    if use_gpu:
+        cov, E, R = _get_pca_gpu(cov=cov, signal=signal, keep_cov=keep_cov)
+    else:
+        # Only scribble on cov if it is ours (and, for the eigensolver,
+        # won't be returned).
+        computed = cov is None
+        overwrite = computed and not keep_cov
+        if computed:
+            # Compute it from signal
+            cov = _get_cov(signal)
+        # cov is symmetric, so use eigh; zero out any nans first since
+        # check_finite is disabled.
+        cov = np.nan_to_num(cov, copy=not computed)
+        E, R = None, None
+        if n_modes is not None and 1 <= n_modes < cov.shape[0] // 4:
+            # Only a few modes are wanted; a Lanczos solver is much
+            # cheaper than the full decomposition.  Use a fixed
+            # starting vector so results are reproducible.
+            try:
+                E, R = scipy.sparse.linalg.eigsh(
+                    cov, k=n_modes, which='LA', v0=np.ones(cov.shape[0]))
+                order = np.argsort(E)
+                E, R = E[order], R[:, order]
+            except scipy.sparse.linalg.ArpackNoConvergence:
+                logger.warning('Lanczos eigensolver did not converge; '
+                               'falling back to full decomposition.')
+        if E is None:
+            E, R = scipy.linalg.eigh(cov, driver='evd', check_finite=False,
+                                     overwrite_a=overwrite)
+
+    if not keep_cov:
+        cov = None
+    return _wrap_pca(tod.dets, cov, E, R, n_modes=n_modes)
+
+
+def get_pca_batched(tods, signals=None, keep_cov=False, n_modes=None):
+    """Compute PCA decompositions for several TODs at once.  This is
+    equivalent to calling get_pca on each TOD, but the
+    eigendecompositions of all covariance matrices with the same
+    number of detectors are done in a single batched call, which
+    makes better use of threads than many small separate calls.
 
-    mode_axis = core.IndexAxis('eigen', dets.count)
-    output = core.AxisManager(dets, mode_axis)
-    output.wrap('cov', cov, [(0, dets.name), (1, dets.name)])
+    Arguments:
+        tods: list of AxisManagers with dets and samps axes.
+        signals: list of arrays of shape (dets, samps), one per TOD,
+            from which to compute the covariances.  Defaults to the
+            .signal of each TOD.
+        keep_cov: boolean; if True then each covariance matrix is
+            stored in its output, as 'cov'.
+        n_modes: integer; if set then only the strongest n_modes
+            eigenmodes are kept in each output.  The full
+            decomposition is still computed.
 
-    # Note eig will sometimes return complex eigenvalues.
-    E, R = np.linalg.eig(cov)  # eigh nans sometimes...
-    E[np.isnan(E)] = 0.
-    E, R = E.real, R.real
+    Returns:
+        List of AxisManagers, one per TOD, of the kind returned by
+        get_pca.
 
-    idx = np.argsort(-E)
-    output.wrap('E', E[idx], [(0, mode_axis.name)])
-    output.wrap('R', R[:, idx], [(0, dets.name), (1, mode_axis.name)])
+    """
+    if signals is None:
+        signals = [tod.signal for tod in tods]
+    covs = [_get_cov(signal) for signal in signals]
+
+    # Group by n_dets, since only matrices of the same shape can be
+    # stacked.
+    groups = {}
+    for i, cov in enumerate(covs):
+        groups.setdefault(cov.shape[0], []).append(i)
+
+    outputs = [None] * len(covs)
+    for idx in groups.values():
+        stack = np.nan_to_num(np.stack([covs[i] for i in idx]), copy=False)
+        if not keep_cov:
+            for i in idx:
+                covs[i] = None
+        E, R = np.linalg.eigh(stack)
+        del stack
+        for k, i in enumerate(idx):
+            outputs[i] = _wrap_pca(tods[i].dets, covs[i], E[k], R[k],
+                                   n_modes=n_modes)
+    return outputs
+
+
+def _wrap_pca(dets, cov, E, R, n_modes=None):
+    """Package a decomposition, with E in ascending order as returned
+    by eigh, into the AxisManager returned by get_pca.  Only the
+    strongest n_modes eigenmodes are kept; cov is stored unless it is
+    None.  The sign of each eigenvector is fixed so that its largest
+    component is positive; this modifies R in place.
+
+    """
+    if n_modes is None:
+        n_modes = len(E)
+    mode_axis = core.IndexAxis('eigen', n_modes)
+    output = core.AxisManager(dets, mode_axis)
+    if cov is not None:
+        output.wrap('cov', cov, [(0, dets.name), (1, dets.name)])
+
+    # eigh returns eigenvalues in ascending order, so the strongest
+    # modes are at the end and no sort is needed.
+    R = R[:, ::-1][:, :n_modes]
+    # Fix the arbitrary sign of each eigenvector.
+    flip = R[np.argmax(abs(R), axis=0), np.arange(R.shape[1])] < 0
+    R[:, flip] *= -1
+    output.wrap('E', E[::-1][:n_modes], [(0, mode_axis.name)])
+    output.wrap('R', R, [(0, dets.name), (1, mode_axis.name)])
     return output
 
 
+def _get_cov(signal):
+    """Compute the covariance of the rows of signal, like np.cov(signal),
+    but using a matrix product on the mean-subtracted data so that the
+    work is done by (threaded) BLAS.
+
+    """
+    mu = signal.mean(axis=1, keepdims=True)
+    # Float buffer, so that integer signal is handled like np.cov does.
+    Xc = np.subtract(signal, mu, out=np.empty(
+        signal.shape, np.result_type(signal, np.float32)))
+    cov = Xc @ Xc.T
+    cov /= (signal.shape[1] - 1)
+    return cov
+
+
+def _is_cupy(x):
+    return type(x).__module__.split('.')[0] == 'cupy'
+
+
+def _get_cupy():
+    """Return the cupy module if it can be imported and a CUDA device
+    is present, otherwise None.
+
+    """
+    try:
+        import cupy
+        if cupy.cuda.runtime.getDeviceCount() > 0:
+            return cupy
+    except Exception:
+        pass
+    return None
+
+
+def _get_pca_gpu(cov=None, signal=None, keep_cov=False):
+    """GPU version of the covariance and eigendecomposition steps of
+    get_pca.  signal (or cov) may be a numpy or CuPy array; if it is
+    already on the device no copy is made.  Returns numpy arrays cov,
+    E, R, with E in ascending order; cov is None unless keep_cov.
+
+    """
+    cp = _get_cupy()
+    if cov is None:
+        x = cp.asarray(signal)
+        xc = x - x.mean(axis=1, keepdims=True)
+        cov = xc @ xc.T
+        cov /= (x.shape[1] - 1)
+        del x, xc
+    else:
+        cov = cp.asarray(cov)
+    cov = cp.nan_to_num(cov)
+    E, R = cp.linalg.eigh(cov)
+    cov = cp.asnumpy(cov) if keep_cov else None
+    return cov, cp.asnumpy(E), cp.asnumpy(R)
+
+
 def add_model(tod, model, scale=1., signal=None, modes=None, weights=None):
     """Adds modeled modes, multiplied by some scale factor, into signal.
 
@@ -166,13 +352,89 @@ def add_model(tod, model, scale=1., signal=None, modes=None, weights=None):
         modes = model.modes
     if weights is None:
         weights = model.weights
-    for i in range(model.dets.count):
-        if np.all(weights[i] == 0):
-            continue
-        signal[i] += np.dot(weights[i, :] * scale, modes)
+    # A single vectorized pass over weights.  Note this is not done
+    # with a sum of squares, which would underflow to zero for tiny
+    # (especially float32) weights and would drop rows containing nan.
+    active = np.flatnonzero(weights.any(axis=1))
+    if active.size == 0:
+        return signal
+    # Look up gemm and cast the inputs once, not once per block.
+    gemm = _get_gemm(signal)
+    if gemm is not None:
+        modes = modes.astype(signal.dtype, copy=False)
+        weights = weights.astype(signal.dtype, copy=False)
+    if active.size == weights.shape[0]:
+        _accumulate_gemm(signal, weights, modes, scale, gemm)
+        return signal
+    # Accumulate into each contiguous block of active detectors.  The
+    # blocks of signal are views, so nothing of size (dets, samps) is
+    # allocated and the rows are not gathered into a copy.  If the
+    # blocks are so small that per-call overhead dominates, one
+    # gathered product is cheaper than many small ones.
+    mask = np.zeros(weights.shape[0] + 2, bool)
+    mask[active + 1] = True
+    edges = np.flatnonzero(np.diff(mask))
+    n_blocks = len(edges) // 2
+    if active.size * signal.shape[1] < n_blocks * _MIN_GEMM_BLOCK_SIZE:
+        signal[active] += scale * (weights[active] @ modes)
+        return signal
+    for i0, i1 in zip(edges[::2], edges[1::2]):
+        _accumulate_gemm(signal[i0:i1], weights[i0:i1], modes, scale, gemm)
     return signal
 
 
+# Minimum mean number of elements per block of active detectors for
+# add_model to call gemm block by block rather than gathering rows.
+_MIN_GEMM_BLOCK_SIZE = 1000
+
+
+def _get_gemm(signal):
+    """Return the BLAS gemm routine that can accumulate into signal in
+    place, or None if signal is not a non-empty, C-ordered float32 or
+    float64 array.
+
+    """
+    if (signal.size == 0
+            or signal.dtype not in (np.float32, np.float64)
+            or not signal.flags['C_CONTIGUOUS']):
+        return None
+    return scipy.linalg.blas.get_blas_funcs('gemm', dtype=signal.dtype)
+
+
+def _accumulate_gemm(signal, weights, modes, scale, gemm):
+    """Perform signal += scale * (weights . modes) in place.  If gemm
+    (from _get_gemm) is not None, it is called directly to accumulate
+    into signal without allocating a temporary of shape (dets, samps);
+    weights and modes must then already have the dtype of signal.
+
+    """
+    if gemm is None:
+        signal += scale * (weights @ modes)
+        return
+    # Work on the transpose, which is Fortran-ordered, so gemm can
+    # write into signal without copying it.
+    out = gemm(alpha=scale, a=modes.T, b=weights.T, c=signal.T,
+               beta=1., overwrite_c=True)
+    if not np.shares_memory(out, signal):
+        signal[:] = out.T
+
+
+@functools.lru_cache(maxsize=2)
+def _trend_modes(n):
+    """Return the (2, n) modes used by get_trends: a row of ones and a
+    line from -0.5 to +0.5.  The result is cached and read-only.
+
+    """
+    modes = np.empty((2, n))
+    modes[0].fill(1.)
+    # Same as np.linspace(-0.5, 0.5, n), but written in place.
+    inv = 1. / (n - 1) if n > 1 else 0.
+    np.multiply(np.arange(n, dtype=modes.dtype), inv, out=modes[1])
+    modes[1] -= 0.5
+    modes.setflags(write=False)
+    return modes
+
+
 def get_trends(tod, remove=False, size=1, signal=None):
     """Computes trends for each detector signal that remove the slope
     connecting first and last points, as well as the mean of the
@@ -193,19 +455,22 @@ def get_trends(tod, remove=False, size=1, signal=None):
         'weights' has shape (dets, eigen) and the field 'modes' has
         shape (eigen, samps).  There are two modes, which always have
         the same form: index 0 is all ones, and index1 is a smooth
-        line from -0.5 to +0.5.
+        line from -0.5 to +0.5.  The modes array is shared between
+        calls and is read-only.
 
     """
     if signal is None:
         signal = tod.signal
     trends = core.AxisManager(tod.dets, core.IndexAxis('eigen', 2), tod.samps)
-    modes = np.ones((trends.eigen.count, trends.samps.count))
-    modes[1] = np.linspace(-0.5, 0.5, modes.shape[1])
+    modes = _trend_modes(trends.samps.count)
     weights = np.empty((trends.dets.count, trends.eigen.count))
-    weights[:, 0] = signal.mean(axis=1)
+    # The mean and the trailing sum reduce straight into weights; the
+    # leading sum makes one small (dets,) temporary.
+    np.mean(signal, axis=1, out=weights[:, 0])
     size = max(1, min(size, signal.shape[1] // 2))
-    weights[:, 1] = (signal[:, -size:].mean(axis=1) -
-                     signal[:, :size].mean(axis=1))
+    np.sum(signal[:, -size:], axis=1, out=weights[:, 1])
+    weights[:, 1] -= signal[:, :size].sum(axis=1)
+    weights[:, 1] /= size
     trends.wrap('modes', modes)
     trends.wrap('weights', weights)
     if remove:
@@ -0,0 +1,60 @@
+# Copyright (c) 2021 Simons Observatory.
+# Full license can be found in the top level "LICENSE" file.
+
+"""Check preprocess pipeline construction.
+
+"""
+
+import pickle
+import unittest
+
+from sotodlib.preprocess import _Preprocess, PIPELINE, processes
+from sotodlib.site_pipeline import preprocess_tod
+
+
+class RegistryTest(unittest.TestCase):
+    def test_registry(self):
+        expected = {
+            "fft_trim": processes.FFTTrim,
+            "detrend": processes.Detrend,
+            "trends": processes.Trends,
+            "glitches": processes.GlitchDetection,
+            "psd": processes.PSDCalc,
+            "noise": processes.Noise,
+            "calibrate": processes.Calibrate,
+            "estimate_hwpss": processes.EstimateHWPSS,
+            "subtract_hwpss": processes.SubtractHWPSS,
+            "apodize": processes.Apodize,
+            "demodulate": processes.Demodulate,
+            "glitchfill": processes.GlitchFill,
+        }
+        for name, cls in expected.items():
+            self.assertIs(PIPELINE.get(name), cls)
+            self.assertEqual(cls.name, name)
+
+    def test_duplicate(self):
+        with self.assertRaises(ValueError):
+            class Dup(_Preprocess, name="detrend"):
+                pass
+        self.assertIs(PIPELINE["detrend"], processes.Detrend)
+
+
+class PipeTest(unittest.TestCase):
+    def test_build_pipe(self):
+        configs = {"process_pipe": [
+            {"name": "detrend", "process": {}},
+            {"name": "trends"},
+            {"name": "psd", "save": True},
+            {"name": "not_a_step", "process": {}},
+        ]}
+        pipe = preprocess_tod._build_pipe_from_configs(configs)
+        self.assertEqual([p.name for p in pipe], ["detrend", "trends", "psd"])
+        # Unconfigured functions of a step do nothing.
+        self.assertIsNone(pipe[1].process(None, None))
+        self.assertEqual(pipe[1].select("meta"), "meta")
+
+    def test_pickle(self):
+        # Steps are sent to worker processes, so must pickle.
+        step = PIPELINE["trends"]({"calc": {}})
+        step2 = pickle.loads(pickle.dumps(step))
+        self.assertEqual(step2.calc_cfgs, {})
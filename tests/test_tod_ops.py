@@ -114,6 +114,106 @@ class PcaTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             tod_ops.detrend_tod(tod, signal_name='sig1e')
 
+    def test_pca(self):
+        tod = get_tod('white')
+        pca = tod_ops.pca.get_pca(tod, keep_cov=True)
+        assert_allclose(pca.cov, np.cov(tod.signal))
+        # Eigenmodes sorted strongest first, and reconstruct cov.
+        self.assertTrue(np.all(np.diff(pca.E) <= 0))
+        assert_allclose(pca.R @ np.diag(pca.E) @ pca.R.T, pca.cov,
+                        atol=1e-10)
+        # GPU path (or CPU fallback, if CuPy is unavailable).
+        pca_gpu = tod_ops.pca.get_pca(tod, use_gpu=True)
+        assert_allclose(pca_gpu.E, pca.E)
+        assert_allclose(pca_gpu.R, pca.R, atol=1e-6)
+        # Truncated decomposition keeps the strongest modes.
+        pca2 = tod_ops.pca.get_pca(tod, n_modes=2)
+        self.assertEqual(pca2.eigen.count, 2)
+        assert_allclose(pca2.E, pca.E[:2])
+        self.assertNotIn('cov', pca2)
+        # Integer signal is fine too.
+        isig = (tod.signal * 100).astype(int)
+        pcai = tod_ops.pca.get_pca(tod, signal=isig, keep_cov=True)
+        assert_allclose(pcai.cov, np.cov(isig))
+        # A cov passed in by the caller is not modified.
+        cov = np.cov(tod.signal)
+        cov[0, 1] = cov[1, 0] = np.nan
+        tod_ops.pca.get_pca(tod, cov=cov)
+        self.assertTrue(np.isnan(cov[0, 1]))
+
+    def test_pca_partial(self):
+        # Enough dets that a few modes use the partial eigensolver.
+        n_dets = 40
+        tod = core.AxisManager(
+            core.LabelAxis('dets', ['d%i' % i for i in range(n_dets)]),
+            core.IndexAxis('samps', 1000))
+        signal = np.random.normal(size=(n_dets, 1000))
+        # Inject a few well-separated common modes.
+        for amp in [10., 5., 3.]:
+            signal += amp * np.outer(np.random.normal(size=n_dets),
+                                     np.random.normal(size=1000))
+        tod.wrap('signal', signal, [(0, 'dets'), (1, 'samps')])
+        pca = tod_ops.pca.get_pca(tod)
+        pca3 = tod_ops.pca.get_pca(tod, n_modes=3)
+        assert_allclose(pca3.E, pca.E[:3])
+        assert_allclose(pca3.R, pca.R[:, :3], atol=1e-6)
+        # Repeatable from call to call.
+        assert_array_equal(tod_ops.pca.get_pca(tod, n_modes=3).R, pca3.R)
+        # Modes are computed in the signal dtype by default.
+        model = tod_ops.pca.get_pca_model(tod, pca=pca3)
+        self.assertEqual(model.modes.dtype, np.float64)
+        model = tod_ops.pca.get_pca_model(tod, pca=pca3, dtype=np.float32)
+        self.assertEqual(model.modes.dtype, np.float32)
+        # No modes at all is allowed.
+        model = tod_ops.pca.get_pca_model(tod, n_modes=0)
+        self.assertEqual(model.modes.shape, (0, tod.samps.count))
+
+    def test_pca_batched(self):
+        tods = [get_tod('white') for i in range(3)]
+        pcas = tod_ops.pca.get_pca_batched(tods)
+        for tod, pca in zip(tods, pcas):
+            pca1 = tod_ops.pca.get_pca(tod)
+            assert_allclose(pca.E, pca1.E)
+            assert_allclose(pca.R, pca1.R, atol=1e-10)
+        pcas = tod_ops.pca.get_pca_batched(tods, n_modes=2)
+        self.assertEqual(pcas[0].eigen.count, 2)
+
+    def test_trend_modes(self):
+        for n in [1, 2, 3, 1000]:
+            modes = tod_ops.pca._trend_modes(n)
+            assert_array_equal(modes[0], 1.)
+            assert_allclose(modes[1], np.linspace(-0.5, 0.5, n),
+                            atol=1e-15)
+
+    def test_add_model(self):
+        tod = get_tod('trendy')
+        sig0 = tod.signal.copy()
+        trends = tod_ops.pca.get_trends(tod)
+        # Zero weights for one detector should leave it untouched.
+        weights = trends.weights.copy()
+        weights[1] = 0.
+        tod_ops.pca.add_model(tod, trends, scale=-1, weights=weights)
+        assert_array_equal(tod.signal[1], sig0[1])
+        for i in [0, 2]:
+            self.assertTrue(np.ptp(tod.signal[i]) < np.ptp(sig0[i]) * 1e-6)
+        # Many small blocks of active dets (gathered product), and a
+        # few large ones (block-wise gemm).
+        for n_samps in [50, 5000]:
+            modes = np.random.normal(size=(3, n_samps)).astype('float32')
+            weights = np.random.normal(size=(20, 3))
+            weights[::2] = 0
+            signal = np.random.normal(size=(20, n_samps))
+            expected = signal - weights @ modes
+            tod_ops.pca.add_model(None, None, scale=-1, signal=signal,
+                                  modes=modes, weights=weights)
+            assert_allclose(signal, expected, atol=1e-6)
+        # Tiny (but nonzero) weights must not be treated as zero.
+        weights = np.zeros((tod.dets.count, 2), dtype='float32')
+        weights[0] = 1e-30
+        signal = np.zeros(tod.shape)
+        tod_ops.pca.add_model(tod, trends, signal=signal, weights=weights)
+        self.assertTrue(np.all(signal[0] != 0))
+
 class GapFillTest(unittest.TestCase):
     def test_basic(self):
         """Test linear fill on simple linear data."""